@@ -9,45 +9,92 @@ from src.db import (
     update_lot,
 )
 from src.process_manager import process_manager
+from src.jpeg import decode_jpeg
 
-import cv2, os, time, shutil, urllib.request, numpy as np, json
+import cv2, os, time, shutil, json, requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+    ORJSON_OK = True
+except ImportError:
+    ORJSON_OK = False
 
 app = Flask(__name__)
 
 FALLBACK_IMAGE = "static/img/fallback.jpg"
 
+# Keep-alive session for snapshot cameras (skips TCP/TLS handshake per poll)
+_session = requests.Session()
+_session.headers["Connection"] = "keep-alive"
+
+
+def size_http_pool(n):
+    """Keep-alive pool big enough for n lots captured on threads."""
+    n = max(4, n)
+    adapter = HTTPAdapter(pool_connections=n, pool_maxsize=n)
+    _session.mount("http://", adapter)
+    _session.mount("https://", adapter)
+
+
+size_http_pool(4)
+
+# FFmpeg backend options for stream cameras: threaded decode, no input
+# buffering, low-delay flags. Must be set before the first VideoCapture.
+os.environ.setdefault(
+    "OPENCV_FFMPEG_CAPTURE_OPTIONS",
+    "threads;4|fflags;nobuffer|flags;low_delay",
+)
+
 
+def is_snapshot_url(url):
+    """Cameras that serve a single JPEG per request."""
+    u = url.lower()
+    return u.endswith(".jpg") or "snapshot" in u
 
-def get_single_frame_universal(url, flip=0):
+
+def fetch_jpeg_bytes(url):
+    """Raw JPEG bytes from a snapshot camera, or None."""
+    try:
+        resp = _session.get(url, timeout=5)
+        resp.raise_for_status()
+        data = resp.content
+    except Exception:
+        return None
+    # SOI marker check so HTML error pages never reach disk
+    return data if data[:2] == b"\xff\xd8" else None
+
+
+def get_single_frame_universal(url, flip=0, try_snapshot=True):
     """
     Clean, universal, reliable frame capture.
     - Tries direct JPEG first (fastest)
     - Falls back to VideoCapture for all MJPEG/RTSP streams
+    - try_snapshot=False goes straight to VideoCapture
     """
 
     # TRY SNAPSHOT MODE 
     try:
-        if url.lower().endswith(".jpg") or "snapshot" in url.lower():
-            req = urllib.request.urlopen(url, timeout=5)
-            arr = np.asarray(bytearray(req.read()), dtype=np.uint8)
-            img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+        if try_snapshot and is_snapshot_url(url):
+            data = fetch_jpeg_bytes(url)
+            img = decode_jpeg(data) if data else None
             if img is not None:
                 if flip:
-                    img = cv2.rotate(img, cv2.ROTATE_180)
+                    cv2.flip(img, -1, dst=img)  # 180 deg, in place
                 return img
     except:
         pass
 
     # TRY OPENCV VIDEOCAPTURE (FOR ANY STREAM TYPE) 
     try:
-        cap = cv2.VideoCapture(url)
+        cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
         if cap.isOpened():
             cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             ok, frame = cap.read()
             cap.release()
             if ok and frame is not None:
                 if flip:
-                    frame = cv2.rotate(frame, cv2.ROTATE_180)
+                    cv2.flip(frame, -1, dst=frame)  # 180 deg, in place
                 return frame
     except Exception as e:
         print("[VideoCapture ERROR]", e)
@@ -68,12 +115,22 @@ def frame_latest(lot_id):
 # HELPERS
 
 def get_latest_jpg(folder):
-    if not os.path.exists(folder):
-        return None
-    jpgs = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".jpg")]
-    if not jpgs:
+    """Newest .jpg in folder by mtime, or None. One directory pass, no sort."""
+    latest, latest_m = None, -1.0
+    try:
+        with os.scandir(folder) as it:
+            for e in it:
+                if not e.name.endswith(".jpg"):
+                    continue
+                try:
+                    m = e.stat().st_mtime
+                except OSError:
+                    continue  # pruned by detect between listing and stat
+                if m > latest_m:
+                    latest, latest_m = e.path, m
+    except FileNotFoundError:
         return None
-    return max(jpgs, key=os.path.getmtime)
+    return latest
 
 # ROUTES
 
@@ -242,8 +299,13 @@ def api_save_config(lot_id):
         return jsonify({"error": "Missing stalls"}), 400
 
     path = f"data/lot{lot_id}/lot_config.json"
-    with open(path, "w") as f:
-        json.dump({"stalls": stalls}, f, indent=2)
+    if ORJSON_OK:
+        # Serialized in one call and written with a single write()
+        with open(path, "wb") as f:
+            f.write(orjson.dumps({"stalls": stalls}, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w") as f:
+            json.dump({"stalls": stalls}, f, indent=2)
 
     return jsonify({"status": "ok"})
 
@@ -1,17 +1,94 @@
-import cv2, os, time, argparse, urllib.request, numpy as np
+import os, time, argparse, queue, threading
+from concurrent.futures import ThreadPoolExecutor
 from src.db import get_lot_by_id
-from app import get_single_frame_universal
+from app import get_single_frame_universal, is_snapshot_url, fetch_jpeg_bytes, size_http_pool
+from src.jpeg import write_jpeg, write_bytes, open_dir_fd, decode_jpeg, JPEG_QUALITY
+from src.shm_frame import SharedFrameWriter
 
 
 INTERVAL = 2.0  # seconds between frames
+STATS_EVERY = 10.0  # seconds between [stats] log lines
+
+
+# Per-lot counters used to tune the capture interval and JPEG quality
+class CaptureStats:
+    def __init__(self):
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self.write_ms = 0.0  # EMA of encode + write time
+
+    def record_write(self, ms):
+        self.written += 1
+        self.write_ms = 0.9 * self.write_ms + 0.1 * ms
+
+
+# Log frame rate, drops, writes, write time and queue depth every STATS_EVERY s
+def stats_reporter(stats, q, lot_id, stop):
+    last_n, last_t = 0, time.monotonic()
+    while not stop.wait(STATS_EVERY):
+        now = time.monotonic()
+        fps = (stats.captured - last_n) / (now - last_t)
+        last_n, last_t = stats.captured, now
+        print(
+            f"[stats] lot={lot_id} fps={fps:.2f} cap={stats.captured} "
+            f"drop={stats.dropped} written={stats.written} "
+            f"write={stats.write_ms:.1f}ms qdepth={q.qsize()}"
+        )
+
+
+# Sleep to the next INTERVAL slot (missed slots are skipped) and return it
+def wait_until_next(next_t, stop):
+    next_t += INTERVAL
+    now = time.monotonic()
+    if next_t < now:
+        next_t += ((now - next_t) // INTERVAL + 1) * INTERVAL
+    stop.wait(next_t - now)
+    return next_t
+
+
+# Put item on q, dropping the oldest when full; returns the number dropped
+def push_latest(q, item):
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+# Writer thread: frames until None; a frame is BGR or JPEG bytes
+def frame_writer(q, save_path, lot_id, dir_fd=None, quality=JPEG_QUALITY,
+                 stats=None, shared=None):
+    while True:
+        frame = q.get()
+        if frame is None:
+            break
+        try:
+            t0 = time.perf_counter()
+            if shared is not None:
+                raw = decode_jpeg(frame) if isinstance(frame, bytes) else frame
+                if raw is not None:
+                    shared.write(raw)
+            if isinstance(frame, bytes):
+                write_bytes(save_path, frame, dir_fd=dir_fd)
+            else:
+                write_jpeg(save_path, frame, quality, dir_fd=dir_fd)
+            if stats is not None:
+                stats.record_write((time.perf_counter() - t0) * 1000)
+            print(f"[Capture] Lot {lot_id}: saved latest.jpg")
+        except Exception as e:
+            print(f"[Capture] Lot {lot_id}: write failed: {e}")
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Spotection Frame Capture")
-    parser.add_argument("--lot", type=int, required=True)
-    args = parser.parse_args()
-
-    lot_id = args.lot
+# Capture loop for one lot, until stop is set (forever if None)
+def capture_lot(lot_id, stop=None, quality=JPEG_QUALITY):
+    stop = stop or threading.Event()
     lot_info = get_lot_by_id(lot_id)
 
     if not lot_info:
@@ -27,26 +104,58 @@ def main():
     for d in (base, frames, overlays, maps):
         os.makedirs(d, exist_ok=True)
 
+    snapshot = is_snapshot_url(url)
+
     print(f"[Capture] Lot {lot_id} stream: {url}")
     print(f"[Capture] Saving latest.jpg every {INTERVAL}s")
 
+    # Grab on this thread, encode/write on a worker so disk stalls
+    # never delay the next grab. Every frame overwrites the same latest.jpg,
+    # so the queue holds one frame and a newer grab replaces it.
+    dir_fd = open_dir_fd(frames)
+    save_path = "latest.jpg" if dir_fd is not None else os.path.join(frames, "latest.jpg")
+    q = queue.Queue(maxsize=1)
+    stats = CaptureStats()
+    try:
+        shared = SharedFrameWriter(lot_id)
+    except OSError as e:
+        print(f"[Capture] Lot {lot_id}: shared memory unavailable ({e}), latest.jpg only")
+        shared = None
+    writer = threading.Thread(
+        target=frame_writer,
+        args=(q, save_path, lot_id, dir_fd, quality, stats, shared),
+        daemon=True
+    )
+    writer.start()
+    threading.Thread(
+        target=stats_reporter, args=(stats, q, lot_id, stop), daemon=True
+    ).start()
+
+    next_t = time.monotonic()
+
     try:
-        while True:
+        while not stop.is_set():
+            # Served from src.db's in-memory lots snapshot (LOTS_CACHE_TTL)
             lot_info = get_lot_by_id(lot_id)
             flip = lot_info.get("flip", 0)
 
-            frame = get_single_frame_universal(url, flip=flip)
+            # Unflipped snapshot JPEGs go to disk as-is (no decode/re-encode)
+            fetched = snapshot and not flip
+            frame = fetch_jpeg_bytes(url) if fetched else None
+            if frame is None:
+                # A failed fetch above is not retried; go on to VideoCapture
+                frame = get_single_frame_universal(url, flip=flip, try_snapshot=not fetched)
 
             if frame is None:
                 print(f"[Capture] Lot {lot_id}: FAILED frame grab")
-                time.sleep(1)
+                stop.wait(1)
+                next_t = time.monotonic()
                 continue
 
-            save_path = os.path.join(frames, "latest.jpg")
-            cv2.imwrite(save_path, frame)
-            print(f"[Capture] Lot {lot_id}: saved latest.jpg")
+            stats.captured += 1
+            stats.dropped += push_latest(q, frame)
 
-            time.sleep(INTERVAL)
+            next_t = wait_until_next(next_t, stop)
 
     except KeyboardInterrupt:
         print("[Capture] Stopped")
@@ -54,6 +163,43 @@ def main():
     except Exception as e:
         print(f"[Capture] ERROR in lot {lot_id}: {e}")
 
+    finally:
+        push_latest(q, None)
+        writer.join(timeout=5)
+        if dir_fd is not None:
+            os.close(dir_fd)
+        if shared is not None and not writer.is_alive():
+            shared.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spotection Frame Capture")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--lot", type=int)
+    group.add_argument("--lots", type=str, help="comma-separated lot ids, one thread each")
+    parser.add_argument("--jpeg-quality", type=int, default=JPEG_QUALITY)
+    args = parser.parse_args()
+
+    if args.lot is not None:
+        capture_lot(args.lot, quality=args.jpeg_quality)
+        return
+
+    # One thread per lot; network, disk and JPEG work release the GIL
+    lot_ids = [int(x) for x in args.lots.split(",") if x.strip()]
+    size_http_pool(len(lot_ids))
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(lot_ids)) as pool:
+        futures = [pool.submit(capture_lot, lid, stop, args.jpeg_quality) for lid in lot_ids]
+        try:
+            while not all(f.done() for f in futures):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print("[Capture] Stopped")
+            stop.set()
+    for lid, f in zip(lot_ids, futures):
+        if f.exception():
+            print(f"[Capture] ERROR in lot {lid}: {f.exception()}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+import numpy as np
+from numba import njit
+
+
+# One Sutherland-Hodgman pass: keep coord[axis] <= bound (keep_low) or >= bound
+@njit(cache=True)
+def _clip_edge(xs, ys, n, ox, oy, axis, bound, keep_low):
+    m = 0
+    for i in range(n):
+        j = i + 1 if i + 1 < n else 0
+        di = (xs[i] if axis == 0 else ys[i]) - bound
+        dj = (xs[j] if axis == 0 else ys[j]) - bound
+        if keep_low:
+            di = -di
+            dj = -dj
+        if di >= 0:
+            ox[m] = xs[i]
+            oy[m] = ys[i]
+            m += 1
+        if (di >= 0) != (dj >= 0):
+            t = di / (di - dj)
+            ox[m] = xs[i] + t * (xs[j] - xs[i])
+            oy[m] = ys[i] + t * (ys[j] - ys[i])
+            m += 1
+    return m
+
+
+# Area of polygon (xs, ys) inside the rect x1..x2, y1..y2
+@njit(cache=True)
+def clip_area_nb(xs, ys, x1, y1, x2, y2):
+    cap = 2 * len(xs) + 8
+    ax = np.empty(cap)
+    ay = np.empty(cap)
+    bx = np.empty(cap)
+    by = np.empty(cap)
+    n = _clip_edge(xs, ys, len(xs), ax, ay, 0, x1, False)
+    n = _clip_edge(ax, ay, n, bx, by, 0, x2, True)
+    n = _clip_edge(bx, by, n, ax, ay, 1, y1, False)
+    n = _clip_edge(ax, ay, n, bx, by, 1, y2, True)
+    s = 0.0
+    for i in range(n):
+        j = i + 1 if i + 1 < n else 0
+        s += bx[i] * by[j] - bx[j] * by[i]
+    return abs(s) * 0.5
+
+
+# Compiled twin of detect.clip_occupancy
+@njit(cache=True)
+def clip_occupancy_nb(coords, offsets, stalls_xyxy, poly_area, boxes_xyxy,
+                      stall_frac, box_frac):
+    n = stalls_xyxy.shape[0]
+    k = boxes_xyxy.shape[0]
+    out = np.zeros(n, np.uint8)
+    for i in range(n):
+        xs = coords[offsets[i]:offsets[i + 1], 0]
+        ys = coords[offsets[i]:offsets[i + 1], 1]
+        for j in range(k):
+            bx1 = boxes_xyxy[j, 0]
+            by1 = boxes_xyxy[j, 1]
+            bx2 = boxes_xyxy[j, 2]
+            by2 = boxes_xyxy[j, 3]
+            if (stalls_xyxy[i, 2] <= bx1 or bx2 <= stalls_xyxy[i, 0] or
+                    stalls_xyxy[i, 3] <= by1 or by2 <= stalls_xyxy[i, 1]):
+                continue
+            inter = clip_area_nb(xs, ys, bx1, by1, bx2, by2)
+            if inter <= 0:
+                continue
+            if (inter / poly_area[i] >= stall_frac or
+                    inter / max((bx2 - bx1) * (by2 - by1), 1.0) >= box_frac):
+                out[i] = 1
+                break
+    return out
+
+
+# Compile (or load from cache) at import so the first frame isn't penalized
+clip_occupancy_nb(
+    np.zeros((3, 2)), np.array([0, 3]), np.zeros((1, 4), np.float32),
+    np.ones(1), np.zeros((1, 4)), 0.3, 0.3
+)
@@ -1,12 +1,57 @@
-import sqlite3, json, os
+import sqlite3, json, os, time, threading, atexit
 from datetime import datetime
 
+# stall_status is stored as compact orjson bytes when available.
+# Readers accept both that and legacy JSON text rows.
+try:
+    import orjson
+    _dumps_status = orjson.dumps
+    _loads_status = orjson.loads
+except ImportError:
+    _dumps_status = json.dumps
+    _loads_status = json.loads
+
 DB_PATH = os.path.join("data", "spotection.db")
 
+# journal_mode is stored in the DB file, so it only needs setting once
+_wal_enabled = False
+
+
+def _apply_pragmas(conn):
+    """WAL so readers never block writers; NORMAL sync skips per-commit fsync."""
+    global _wal_enabled
+    if not _wal_enabled:
+        # Only takes effect on a brand-new file (before WAL pins the page
+        # size); existing databases keep theirs
+        conn.execute("PRAGMA page_size=8192")
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_enabled = True
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-20000")
+
+
+# One connection per thread, reused across helper calls
+_tls = threading.local()
+
 
 def _connect():
-    os.makedirs("data", exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        os.makedirs("data", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH)
+        _apply_pragmas(conn)
+        _tls.conn = conn
+    return conn
+
+
+@atexit.register
+def _close():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        conn.close()
+        _tls.conn = None
 
 
 def init_db():
@@ -53,6 +98,12 @@ def init_db():
     except sqlite3.OperationalError:
         pass
 
+    # Latest-result-per-lot lookups seek this index instead of scanning
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_detres_lot_id
+        ON detection_results(lot_id, id DESC)
+    """)
+
 
     # TABLE: lots
     cur.execute("""
@@ -83,14 +134,13 @@ def init_db():
             ("West Campus Lot", "https://taco-about-python.com/video_feed", 45),
             ("East Campus Garage", "http://170.249.152.2:8080/cgi-bin/viewer/video.jpg", 60),
         ]
-        for name, url, total in defaults:
-            cur.execute(
-                "INSERT INTO lots (name, stream_url, total_spots) VALUES (?, ?, ?)",
-                (name, url, total)
-            )
+        cur.executemany(
+            "INSERT INTO lots (name, stream_url, total_spots) VALUES (?, ?, ?)",
+            defaults
+        )
         conn.commit()
+        _invalidate_lots_cache()
 
-    conn.close()
     print("DB initialized.")
 
 # Legacy lot_config helpers
@@ -103,7 +153,6 @@ def save_lot_config(name, config_dict):
         (name, json.dumps(config_dict))
     )
     conn.commit()
-    conn.close()
 
 
 def get_latest_lot_config():
@@ -111,30 +160,28 @@ def get_latest_lot_config():
     cur = conn.cursor()
     cur.execute("SELECT config_json FROM lot_config ORDER BY id DESC LIMIT 1")
     row = cur.fetchone()
-    conn.close()
     return json.loads(row[0]) if row else None
 
 # Detection results helpers
 
 def save_detection_result(frame_path, overlay_path, occupied_count,
                           free_count, stall_status, lot_id=1):
-
+    # Written straight away: the dashboard reads the newest row per lot,
+    # and a commit is cheap under WAL + synchronous=NORMAL
     conn = _connect()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO detection_results
-        (frame_path, overlay_path, timestamp,
-         occupied_count, free_count, stall_status_json, lot_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        frame_path, overlay_path,
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        occupied_count, free_count,
-        json.dumps(stall_status),
-        lot_id
-    ))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("""
+            INSERT INTO detection_results
+            (frame_path, overlay_path, timestamp,
+             occupied_count, free_count, stall_status_json, lot_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            frame_path, overlay_path,
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            occupied_count, free_count,
+            _dumps_status(stall_status),
+            lot_id
+        ))
 
 
 def _row_to_dict(row):
@@ -145,7 +192,7 @@ def _row_to_dict(row):
         "occupied_count", "free_count", "stall_status_json", "lot_id"
     ]
     d = dict(zip(keys, row))
-    d["stall_status_json"] = json.loads(d["stall_status_json"])
+    d["stall_status_json"] = _loads_status(d["stall_status_json"])
     return d
 
 
@@ -154,7 +201,6 @@ def get_latest_detection():
     cur = conn.cursor()
     cur.execute("SELECT * FROM detection_results ORDER BY id DESC LIMIT 1")
     row = cur.fetchone()
-    conn.close()
     return _row_to_dict(row)
 
 
@@ -166,7 +212,6 @@ def get_latest_detection_for_lot(lot_id):
         (lot_id,)
     )
     row = cur.fetchone()
-    conn.close()
     return _row_to_dict(row)
 
 # Lot CRUD helpers
@@ -178,25 +223,40 @@ def _lot_row_to_dict(row):
     return dict(zip(keys, row))
 
 
+# Process-wide snapshot of the (tiny, rarely changing) lots table.
+# Refreshed after LOTS_CACHE_TTL seconds, on any CRUD call in this
+# process, and on a get_lot_by_id miss. Other processes' edits (e.g. a
+# flip toggle from the web app) are picked up within the TTL.
+LOTS_CACHE_TTL = 5.0
+_LOTS_CACHE = {"t": 0.0, "data": None}
+
+
+def _invalidate_lots_cache():
+    _LOTS_CACHE["data"] = None
+
+
+def _load_lots(force=False):
+    data = _LOTS_CACHE["data"]
+    now = time.monotonic()
+    if force or data is None or now - _LOTS_CACHE["t"] > LOTS_CACHE_TTL:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, stream_url, total_spots, created_at, flip FROM lots ORDER BY id ASC")
+        data = {row[0]: _lot_row_to_dict(row) for row in cur.fetchall()}
+        _LOTS_CACHE["data"] = data
+        _LOTS_CACHE["t"] = now
+    return data
+
+
 def get_all_lots():
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, stream_url, total_spots, created_at, flip FROM lots ORDER BY id ASC")
-    rows = cur.fetchall()
-    conn.close()
-    return [_lot_row_to_dict(r) for r in rows]
+    return [dict(lot) for lot in _load_lots().values()]
 
 
 def get_lot_by_id(lot_id):
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, name, stream_url, total_spots, created_at, flip FROM lots WHERE id = ?",
-        (lot_id,)
-    )
-    row = cur.fetchone()
-    conn.close()
-    return _lot_row_to_dict(row)
+    lot = _load_lots().get(lot_id)
+    if lot is None:
+        lot = _load_lots(force=True).get(lot_id)
+    return dict(lot) if lot else None
 
 
 def create_lot(name, stream_url, total_spots=0) -> int:
@@ -208,7 +268,7 @@ def create_lot(name, stream_url, total_spots=0) -> int:
     )
     new_id = cur.lastrowid
     conn.commit()
-    conn.close()
+    _invalidate_lots_cache()
     return new_id
 
 
@@ -236,8 +296,7 @@ def update_lot(lot_id, name=None, stream_url=None, total_spots=None, flip=None):
         params.append(lot_id)
         cur.execute(f"UPDATE lots SET {', '.join(fields)} WHERE id = ?", params)
         conn.commit()
-
-    conn.close()
+        _invalidate_lots_cache()
 
 
 def delete_lot(lot_id):
@@ -246,7 +305,7 @@ def delete_lot(lot_id):
     cur.execute("DELETE FROM detection_results WHERE lot_id = ?", (lot_id,))
     cur.execute("DELETE FROM lots WHERE id = ?", (lot_id,))
     conn.commit()
-    conn.close()
+    _invalidate_lots_cache()
 
 
 if __name__ == "__main__":
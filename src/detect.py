@@ -1,20 +1,47 @@
-import os, json, time, cv2, numpy as np, argparse
+import os, json, time, threading, cv2, numpy as np, argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
-from collections import defaultdict, deque
 from src.db import save_detection_result
+from src.shm_frame import SharedFrameReader
+from src.jpeg import write_jpeg, open_dir_fd
 
 try:
-    from shapely.geometry import Polygon
-    SHAPELY_OK = True
-except:
-    SHAPELY_OK = False
+    from src._overlap_nb import clip_occupancy_nb
+    NUMBA_OK = True
+except Exception:
+    NUMBA_OK = False
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_OK = True
+except ImportError:
+    WATCHDOG_OK = False
+
+try:
+    import torch
+    CUDA_OK = torch.cuda.is_available()
+except Exception:
+    CUDA_OK = False
 
 MODEL_PATH = "yolov8s.pt"
+# Accelerated exports of MODEL_PATH, built by `python -m src.detect --export`
+# and preferred when present: TensorRT FP16 with CUDA, OpenVINO on CPU
+ENGINE_PATH = "yolov8s.engine"
+OPENVINO_PATH = "yolov8s_openvino_model"
+EXPORT_BATCH = 8  # largest batch the TensorRT engine accepts
 CONF = 0.2
 VEHICLE_CLASSES = {2, 3, 5, 7}
+VEHICLE_CLASSES_ARR = np.array(sorted(VEHICLE_CLASSES))
 CHECK_INTERVAL = 2
 FILTER_MIN_AREA = 800
 HISTORY_LEN = 3
+STATIC_DIFF = 4.0  # largest per-cell mean abs diff of an "unchanged" frame
+THUMB_SIZE = (128, 72)  # static-check thumbnail, about 10x10 px per thumb pixel
+THUMB_CELLS = (16, 9)   # grid the thumbnail diff is compared over
+RESCAN_SECS = 60   # run YOLO at least this often even on unchanged frames
+IMGSZ = 1280  # default inference size; override with --imgsz
 KEEP = 5   # keep last overlays/maps
 
 # How strict we are about overlap between a stall and a vehicle box
@@ -24,7 +51,10 @@ BOX_OVERLAP_FRAC = 0.3     # OR fraction of vehicle box area
 # We only use the bottom part of the vehicle box (tires area) for overlap
 BOX_VERTICAL_FRACTION_FROM_TOP = 0.4  # ignore top % of box
 
-stall_history = defaultdict(lambda: deque(maxlen=HISTORY_LEN))
+# model.predict arguments; get_model() switches to FP16 on the GPU
+PREDICT_KW = dict(conf=CONF, imgsz=IMGSZ, verbose=False)
+
+_MODEL = None
 
 
 def get_paths(lot_id):
@@ -43,54 +73,276 @@ def ensure_dirs(lot_id):
         os.makedirs(d, exist_ok=True)
 
 
-def cleanup(folder):
-    if not os.path.exists(folder):
-        return
-    files = sorted([f for f in os.listdir(folder) if f.endswith(".jpg")])
-    full = [os.path.join(folder, f) for f in files]
-    for f in full[:-KEEP]:
-        try:
-            os.remove(f)
-        except:
-            pass
+# folder/<stem>_<epoch ms>.jpg
+def stamped_path(folder, stem):
+    return f"{folder}{os.sep}{stem}_{time.time_ns() // 1_000_000}.jpg"
 
 
-def load_config(lot_id):
-    config_path, *_ = get_paths(lot_id)
-    if not os.path.exists(config_path):
-        print(f"[Detect] Lot {lot_id}: no lot_config.json yet")
+# .jpg paths in folder, oldest first (names sort by timestamp)
+def existing_jpgs(folder):
+    try:
+        names = sorted(e.name for e in os.scandir(folder) if e.name.endswith(".jpg"))
+    except FileNotFoundError:
         return []
+    return [os.path.join(folder, n) for n in names]
 
-    with open(config_path) as f:
-        cfg = json.load(f)
 
-    stalls = []
-    for s in cfg.get("stalls", []):
-        pts = np.array(s["points"], np.int32)
-        entry = {"id": str(s["id"]), "pts": pts, "lane": s["lane"]}
-        if SHAPELY_OK:
-            entry["poly"] = Polygon(pts)
-        stalls.append(entry)
-    return stalls
+# Overlay/map JPEGs are encoded and written on this thread so the next
+# inference can start while the previous frame's images are still saving
+_io_pool = ThreadPoolExecutor(max_workers=1)
 
 
-def draw_map(stalls, occ, lot_id):
-    _, _, _, maps = get_paths(lot_id)
-    os.makedirs(maps, exist_ok=True)
+# folder -> deque of the files in it, oldest first (only touched by the io
+# thread). Seeded from one directory scan, then every write appends its
+# path and deletes whatever falls out past KEEP, so there are no rescans.
+_written = {}
+
+
+# folder -> directory fd for write_jpeg(dir_fd=...), or None where
+# unsupported; opened once so each write is a bare os.open/os.write
+_dir_fds = {}
+
+
+def _save_jpeg(path, img, folder):
+    try:
+        if folder not in _dir_fds:
+            _dir_fds[folder] = open_dir_fd(folder)
+        fd = _dir_fds[folder]
+        write_jpeg(path if fd is None else os.path.basename(path), img, dir_fd=fd)
+    except Exception as e:
+        print(f"[Detect] Failed to write {path}: {e}")
+        return False
+
+    written = _written.get(folder)
+    if written is None:
+        written = _written[folder] = deque(existing_jpgs(folder))
+    else:
+        written.append(path)
+    while len(written) > KEEP:
+        try:
+            os.unlink(written.popleft())
+        except OSError:
+            pass
+    return True
+
+
+# Queue img for the writer thread; folder keeps its newest KEEP files.
+# The future resolves to False if the write failed.
+def save_jpeg_async(path, img, folder):
+    return _io_pool.submit(_save_jpeg, path, img, folder)
+
+
+# lot_id -> (mtime, cfg); lot_config.json is only re-parsed when it changes
+_CFG_CACHE = {}
+
+
+def _build_config(stalls_json, mtime):
+    stalls = [
+        {"id": str(s["id"]), "pts": np.array(s["points"], np.int32), "lane": s["lane"]}
+        for s in stalls_json
+    ]
+
+    # Stacked per-stall geometry consumed by the vectorized overlap code;
+    # polygon i is coords[offsets[i]:offsets[i + 1]]
+    lens = [len(s["pts"]) for s in stalls]
+    coords = (np.concatenate([s["pts"] for s in stalls]).astype(np.float64)
+              if stalls else np.zeros((0, 2)))
+    offsets = np.concatenate(([0], np.cumsum(lens))).astype(np.int64)
+    # Same polygons zero-padded to a common vertex count, for the
+    # pair-vectorized NumPy clip
+    padded = np.zeros((len(stalls), max(lens, default=0), 2))
+    for i, s in enumerate(stalls):
+        padded[i, :lens[i]] = s["pts"]
+
+    # Bounding rects and vertex means for all stalls in single reductions.
+    # The rects match cv2.boundingRect (max edge exclusive).
+    if stalls:
+        starts = offsets[:-1]
+        lo = np.minimum.reduceat(coords, starts)
+        hi = np.maximum.reduceat(coords, starts) + 1
+        means = np.add.reduceat(coords, starts) / np.array(lens)[:, None]
+    else:
+        lo = hi = means = np.zeros((0, 2))
+    bbox = np.hstack([lo, hi]).astype(np.float32)
+    for s, (mx, my) in zip(stalls, means):
+        # overlay label anchor: vertex mean, truncated to pixels
+        s["label_xy"] = (int(mx), int(my))
+        # top-to-bottom order within a lane on the map
+        s["sort_y"] = float(my)
+
+    cfg = {
+        "mtime": mtime,
+        "stalls": stalls,
+        # Per-stall fields as parallel lists for the per-frame code
+        "ids": [s["id"] for s in stalls],
+        "pts": [s["pts"] for s in stalls],
+        "label_xy": [s["label_xy"] for s in stalls],
+        "coords": coords,
+        "offsets": offsets,
+        "padded": padded,
+        "nverts": np.array(lens, np.int64),
+        "bbox": bbox,
+        "poly_area": np.maximum([polygon_area(s["pts"]) for s in stalls], 1.0),
+        # Ring buffer of the last HISTORY_LEN raw occupancy rows per stall
+        "history": np.zeros((len(stalls), HISTORY_LEN), np.uint8),
+        "head": 0,
+        "filled": 0,
+    }
+    return cfg
+
+
+# Stall config (see _build_config), cached until lot_config.json changes
+def load_config(lot_id):
+    config_path, *_ = get_paths(lot_id)
+    try:
+        mtime = os.path.getmtime(config_path)
+    except OSError:
+        print(f"[Detect] Lot {lot_id}: no lot_config.json yet")
+        return _build_config([], None)
+
+    cached = _CFG_CACHE.get(lot_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
 
+    with open(config_path) as f:
+        raw = json.load(f)
+
+    cfg = _build_config(raw.get("stalls", []), mtime)
+    _CFG_CACHE[lot_id] = (mtime, cfg)
+    # Output folders are checked here, once per config, rather than on
+    # every overlay/map write
+    ensure_dirs(lot_id)
+    return cfg
+
+
+# Shoelace area of an (M, 2) polygon
+def polygon_area(pts):
+    x = np.asarray(pts[:, 0], np.float64)
+    y = np.asarray(pts[:, 1], np.float64)
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+# Index of each vertex's successor in padded polygons of n vertices
+def _wrap_next(n, width):
+    j = np.arange(1, width + 1)[None, :]
+    return np.where(j < n[:, None], j, 0)
+
+
+# Areas of P padded polygons inside P xyxy rects, Sutherland-Hodgman per pair
+def clip_polygons_by_rects(polys, n, rects):
+    P = len(polys)
+    rows = np.arange(P)[:, None]
+    for axis, col, sign in ((0, 0, 1), (0, 2, -1), (1, 1, 1), (1, 3, -1)):
+        width = polys.shape[1]
+        valid = np.arange(width)[None, :] < n[:, None]
+        nxt = polys[rows, _wrap_next(n, width)]
+        d = sign * (polys[..., axis] - rects[:, col, None])
+        d_nxt = sign * (nxt[..., axis] - rects[:, col, None])
+        inside = (d >= 0) & valid
+        cross = ((d >= 0) != (d_nxt >= 0)) & valid
+        t = d / np.where(cross, d - d_nxt, 1.0)
+        hits = polys + t[..., None] * (nxt - polys)
+
+        cand = np.stack([polys, hits], 2).reshape(P, 2 * width, 2)
+        keep = np.stack([inside, cross], 2).reshape(P, 2 * width)
+        n = keep.sum(axis=1)
+        # Stable sort moves kept vertices to the front of each row, in order
+        order = np.argsort(~keep, axis=1, kind="stable")[:, :max(int(n.max(initial=0)), 1)]
+        polys = cand[rows, order]
+
+    valid = np.arange(polys.shape[1])[None, :] < n[:, None]
+    nxt = polys[rows, _wrap_next(n, polys.shape[1])]
+    cross = polys[..., 0] * nxt[..., 1] - nxt[..., 0] * polys[..., 1]
+    return 0.5 * np.abs(np.where(valid, cross, 0.0).sum(axis=1))
+
+
+# (K, 4) xyxy vehicle boxes, small ones dropped, cut to the tire area
+def vehicle_boxes(res):
+    data = res.boxes.data  # (K, 6): x1, y1, x2, y2, conf, cls
+    if CUDA_OK and getattr(data, "is_cuda", False):
+        # Filter on the device so only the kept rows come back, in one copy
+        cls = data[:, 5]
+        keep = (data[:, 2] - data[:, 0]) * (data[:, 3] - data[:, 1]) >= FILTER_MIN_AREA
+        is_vehicle = torch.zeros_like(keep)
+        for c in VEHICLE_CLASSES:
+            is_vehicle |= cls == c
+        B = data[keep & is_vehicle, :4].cpu().numpy().astype(np.float64)
+    else:
+        data = res.boxes.cpu().numpy().data.astype(np.float64).reshape(-1, 6)
+        xyxy = data[:, :4]
+        area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+        B = xyxy[np.isin(data[:, 5].astype(np.int32), VEHICLE_CLASSES_ARR) &
+                 (area >= FILTER_MIN_AREA)]
+    B[:, 1] += BOX_VERTICAL_FRACTION_FROM_TOP * (B[:, 3] - B[:, 1])
+    return B
+
+
+# (stall_idx, box_idx) pairs whose bounding boxes overlap
+def bbox_pairs(S, B):
+    ov = ((S[:, None, 0] < B[None, :, 2]) & (B[None, :, 0] < S[:, None, 2]) &
+          (S[:, None, 1] < B[None, :, 3]) & (B[None, :, 1] < S[:, None, 3]))
+    return np.nonzero(ov)
+
+
+# One bool per stall from exact polygon/box overlap of the bbox_pairs
+def clip_occupancy(cfg, B):
+    occ = np.zeros(len(cfg["stalls"]), dtype=bool)
+    if not len(occ) or not len(B):
+        return occ
+
+    if NUMBA_OK:
+        return clip_occupancy_nb(
+            cfg["coords"], cfg["offsets"], cfg["bbox"], cfg["poly_area"], B,
+            STALL_OVERLAP_FRAC, BOX_OVERLAP_FRAC
+        ).astype(bool)
+
+    si, bj = bbox_pairs(cfg["bbox"], B)
+    if len(si) == 0:
+        return occ
+
+    inter = clip_polygons_by_rects(cfg["padded"][si], cfg["nverts"][si], B[bj])
+    box_area = np.maximum((B[:, 2] - B[:, 0]) * (B[:, 3] - B[:, 1]), 1.0)
+
+    hit = (inter > 0) & ((inter / cfg["poly_area"][si] >= STALL_OVERLAP_FRAC) |
+                         (inter / box_area[bj] >= BOX_OVERLAP_FRAC))
+    occ[si[hit]] = True
+    return occ
+
+
+# Majority vote over the last HISTORY_LEN raw occupancy rows
+def smooth(cfg, hits):
+    history = cfg["history"]
+    history[:, cfg["head"]] = hits
+    cfg["head"] = (cfg["head"] + 1) % HISTORY_LEN
+    cfg["filled"] = min(cfg["filled"] + 1, HISTORY_LEN)
+    return history.sum(axis=1) >= cfg["filled"] / 2.0
+
+
+# True once the history is full and every stall's rows agree, so another
+# identical frame cannot change the vote
+def history_settled(cfg):
+    if cfg["filled"] < HISTORY_LEN:
+        return False
+    votes = cfg["history"].sum(axis=1)
+    return not ((votes > 0) & (votes < HISTORY_LEN)).any()
+
+
+# lot_id -> (state hash, path) of the last map written; the map only
+# changes when occupancy or the stall config does
+_LAST_MAP = {}
+
+
+# Static map parts: all-free canvas, all-taken canvas, stall rects
+def _map_layout(stalls):
     # If no stalls, draw a simple placeholder
     if not stalls:
-        canvas = np.zeros((300, 600, 3), dtype=np.uint8) + 40
+        canvas = np.full((300, 600, 3), 40, dtype=np.uint8)
         cv2.putText(
             canvas, "No stalls configured",
             (30, 160), cv2.FONT_HERSHEY_SIMPLEX, 1.0,
             (255, 255, 255), 2
         )
-        ts = int(time.time() * 1000)
-        out_path = os.path.join(maps, f"map_{ts}.jpg")
-        cv2.imwrite(out_path, canvas)
-        cleanup(maps)
-        return out_path
+        return canvas, canvas, []
 
     # Group by lane
     lanes = {}
@@ -99,7 +351,7 @@ def draw_map(stalls, occ, lot_id):
 
     ordered_lanes = [lanes[k] for k in sorted(lanes.keys())]
     for lane in ordered_lanes:
-        lane.sort(key=lambda st: np.mean(st["pts"][:, 1]))
+        lane.sort(key=lambda st: st["sort_y"])
 
     stall_w, stall_h = 130, 80
     pad_x, pad_y = 25, 25
@@ -111,7 +363,9 @@ def draw_map(stalls, occ, lot_id):
     h = margin_y * 2 + rows * (stall_h + pad_y)
     w = margin_x * 2 + cols * (stall_w + pad_x)
 
-    canvas = np.zeros((h, w, 3), dtype=np.uint8) + 40
+    free = np.full((h, w, 3), 40, dtype=np.uint8)
+    taken = free.copy()
+    rects = []
 
     for col, lane in enumerate(ordered_lanes):
         for row, stall in enumerate(lane):
@@ -119,175 +373,373 @@ def draw_map(stalls, occ, lot_id):
             y1 = margin_y + row * (stall_h + pad_y)
             x2, y2 = x1 + stall_w, y1 + stall_h
 
-            color = (0, 0, 255) if occ[stall["id"]] else (0, 255, 0)
-            cv2.rectangle(canvas, (x1, y1), (x2, y2), color, -1)
-            cv2.putText(
-                canvas, stall["id"], (x1 + 10, y1 + 50),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2
-            )
-
-    ts = int(time.time() * 1000)
-    out_path = os.path.join(maps, f"map_{ts}.jpg")
-    cv2.imwrite(out_path, canvas)
-    cleanup(maps)
-    return out_path
+            for canvas, color in ((free, (0, 255, 0)), (taken, (0, 0, 255))):
+                cv2.rectangle(canvas, (x1, y1), (x2, y2), color, -1)
+                cv2.putText(
+                    canvas, stall["id"], (x1 + 10, y1 + 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2
+                )
+            rects.append((x1, y1, x2, y2, stall["id"]))
 
+    return free, taken, rects
 
-def detect_frame(frame_path, model, lot_id):
-    img = cv2.imread(frame_path)
-    if img is None:
-        print(f"[Detect] Skipping unreadable frame: {frame_path}")
-        time.sleep(0.5)
-        return None
 
-    stalls = load_config(lot_id)
-
-    # Run YOLO
-    res = model.predict(img, conf=CONF, imgsz=1280, verbose=False)[0]
-
-    # Build vehicle boxes list (optionally using Shapely)
-    boxes = []
-    for b in res.boxes:
-        if int(b.cls) in VEHICLE_CLASSES:
-            x1, y1, x2, y2 = map(float, b.xyxy[0])
-            w, h = (x2 - x1), (y2 - y1)
-            if w * h < FILTER_MIN_AREA:
-                continue
-
-            # Only keep the bottom portion of the box (tire/contact area)
-            new_y1 = y1 + BOX_VERTICAL_FRACTION_FROM_TOP * h
-            y1 = new_y1
-
-            box_entry = {
-                "coords": (x1, y1, x2, y2),
-                "area": (x2 - x1) * (y2 - y1),
-            }
-            if SHAPELY_OK:
-                box_entry["poly"] = Polygon(
-                    [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
-                )
-            boxes.append(box_entry)
+def draw_map(cfg, occ, lot_id):
+    _, _, _, maps = get_paths(lot_id)
 
-    # Initial occupancy (before smoothing)
-    occ = {s["id"]: False for s in stalls}
+    state = hash((cfg["mtime"], tuple(sorted(occ.items()))))
+    last = _LAST_MAP.get(lot_id)
+    if last and last[0] == state:
+        return last[1]
+
+    # Built once per config; cfg is replaced when lot_config.json changes
+    if "map_layout" not in cfg:
+        cfg["map_layout"] = _map_layout(cfg["stalls"])
+    free, taken, rects = cfg["map_layout"]
+
+    # Start from the all-free map and paste in occupied stalls
+    canvas = free.copy()
+    for x1, y1, x2, y2, sid in rects:
+        if occ[sid]:
+            canvas[y1:y2 + 1, x1:x2 + 1] = taken[y1:y2 + 1, x1:x2 + 1]
+
+    out_path = stamped_path(maps, "map")
+    _LAST_MAP[lot_id] = (state, out_path)
+    save_jpeg_async(out_path, canvas, maps).add_done_callback(
+        lambda f: f.result() or _forget_map(lot_id, out_path))
+    return out_path
 
-    for s in stalls:
-        sid = s["id"]
 
-        if SHAPELY_OK and "poly" in s:
-            stall_poly = s["poly"]
-            stall_area = max(stall_poly.area, 1.0)
+# Drop a map whose write failed, so the next frame draws it again
+def _forget_map(lot_id, path):
+    if _LAST_MAP.get(lot_id, (None, None))[1] == path:
+        del _LAST_MAP[lot_id]
+
+
+# Process-wide YOLO model, loaded and warmed up on first use
+def get_model():
+    global _MODEL
+    if _MODEL is None:
+        path = MODEL_PATH
+        if CUDA_OK and os.path.exists(ENGINE_PATH):
+            path = ENGINE_PATH
+        elif not CUDA_OK and os.path.exists(OPENVINO_PATH):
+            path = OPENVINO_PATH
+        print(f"[Detect] Loading model {path}")
+        model = YOLO(path, task="detect")
+        if CUDA_OK:
+            PREDICT_KW.update(device=0, half=True)
+            # Input shape is fixed by imgsz, so let cuDNN benchmark and
+            # keep the fastest conv algorithms (PyTorch weights only)
+            torch.backends.cudnn.benchmark = True
+        # First predict pays for fusing, kernel selection and allocator
+        # setup; do it now instead of on the first real frame
+        size = PREDICT_KW["imgsz"]
+        model.predict(np.zeros((size, size, 3), np.uint8), **PREDICT_KW)
+        _MODEL = model
+    return _MODEL
+
+
+# Post-inference work for one frame -> (overlay_path, occ, map_path)
+def analyze_frame(img, res, lot_id):
+    cfg = load_config(lot_id)
+
+    B = vehicle_boxes(res)
 
-            for box in boxes:
-                inter_area = stall_poly.intersection(box["poly"]).area
-                if inter_area <= 0:
-                    continue
+    # Initial occupancy (before smoothing)
+    hits = clip_occupancy(cfg, B)
+    taken = smooth(cfg, hits).tolist()
+    occ = dict(zip(cfg["ids"], taken))
+
+    # Draw overlay straight onto img; it is a fresh array (imread or the
+    # shared memory reader's copy) that nothing else uses after this
+    out = img
+    free_pts = [p for p, t in zip(cfg["pts"], taken) if not t]
+    occ_pts = [p for p, t in zip(cfg["pts"], taken) if t]
+    cv2.polylines(out, free_pts, True, (0, 255, 0), 2)
+    cv2.polylines(out, occ_pts, True, (0, 0, 255), 2)
+    for sid, xy, t in zip(cfg["ids"], cfg["label_xy"], taken):
+        color = (0, 0, 255) if t else (0, 255, 0)
+        cv2.putText(out, sid, xy, cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
-                stall_frac = inter_area / stall_area
-                box_frac = inter_area / max(box["area"], 1.0)
+    _, _, overlays, _ = get_paths(lot_id)
+    overlay_path = stamped_path(overlays, "overlay")
+    save_jpeg_async(overlay_path, out, overlays)
 
-                if (stall_frac >= STALL_OVERLAP_FRAC or
-                        box_frac >= BOX_OVERLAP_FRAC):
-                    occ[sid] = True
-                    break
-        else:
-            # Fallback: rectangle overlap with thresholds
-            sx, sy, sw, sh = cv2.boundingRect(s["pts"])
-            stall_area = max(sw * sh, 1.0)
-
-            for box in boxes:
-                x1, y1, x2, y2 = box["coords"]
-                ix1, iy1 = max(x1, sx), max(y1, sy)
-                ix2, iy2 = min(x2, sx + sw), min(y2, sy + sh)
-                if ix2 <= ix1 or iy2 <= iy1:
-                    continue
+    map_path = draw_map(cfg, occ, lot_id)
+    return overlay_path, occ, map_path
 
-                inter_area = (ix2 - ix1) * (iy2 - iy1)
-                stall_frac = inter_area / stall_area
 
-                if stall_frac >= STALL_OVERLAP_FRAC:
-                    occ[sid] = True
-                    break
+# YOLO results for decoded frames, EXPORT_BATCH per predict
+def detect_frames(imgs, model=None):
+    model = model or get_model()
+    preds = []
+    for i in range(0, len(imgs), EXPORT_BATCH):
+        preds += model.predict(imgs[i:i + EXPORT_BATCH], **PREDICT_KW)
+    return preds
+
+
+# One detection_results row for an occupancy dict
+def save_occupancy(lot_id, frame_path, overlay_path, occ):
+    occupied = sum(occ.values())
+    save_detection_result(
+        frame_path=frame_path,
+        overlay_path=overlay_path,
+        occupied_count=occupied,
+        free_count=len(occ) - occupied,
+        stall_status=occ,
+        lot_id=lot_id,
+    )
 
-    # --- Temporal smoothing using stall_history ---
-    for sid, val in occ.items():
-        stall_history[sid].append(val)
-        history = stall_history[sid]
-        # majority vote over last HISTORY_LEN frames
-        occ[sid] = sum(history) >= (len(history) / 2.0)
 
-    # Draw overlay
-    out = img.copy()
-    for s in stalls:
-        color = (0, 0, 255) if occ[s["id"]] else (0, 255, 0)
-        cv2.polylines(out, [s["pts"]], True, color, 2)
-        cx = int(np.mean(s["pts"][:, 0]))
-        cy = int(np.mean(s["pts"][:, 1]))
-        cv2.putText(out, s["id"], (cx, cy),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+# analyze_frame plus the DB row; runs on the post-processing thread.
+# thumb/started are the frame's static-check thumbnail and loop time.
+def finish_frame(img, res, feed, thumb, started):
+    lot_id = feed.lot_id
+    try:
+        overlay_path, occ, map_path = analyze_frame(img, res, lot_id)
+        save_occupancy(lot_id, feed.latest_path, overlay_path, occ)
+        feed.analysed(thumb, started, load_config(lot_id), overlay_path, occ)
+        print(f"[Detect] Lot {lot_id}: processed frame {feed.latest_path}")
+    except Exception as e:
+        print(f"[Detect] ERROR {lot_id}: {e}")
 
-    _, _, overlays, _ = get_paths(lot_id)
-    ts = int(time.time() * 1000)
-    overlay_path = os.path.join(overlays, f"overlay_{ts}.jpg")
-    cv2.imwrite(overlay_path, out)
-    cleanup(overlays)
 
-    map_path = draw_map(stalls, occ, lot_id)
-    return overlay_path, occ, map_path
+# Event set whenever path is written or replaced (None without watchdog)
+def watch_file(path):
+    if not WATCHDOG_OK:
+        return None
+    changed = threading.Event()
+    name = os.path.basename(path)
 
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            dest = getattr(event, "dest_path", "")
+            if name in (os.path.basename(event.src_path), os.path.basename(dest)):
+                changed.set()
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--lot", type=int, required=True)
-    args = parser.parse_args()
-    lot_id = args.lot
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(Handler(), os.path.dirname(path) or ".")
+    observer.start()
+    return changed
 
-    ensure_dirs(lot_id)
-    _, frames_dir, _, _ = get_paths(lot_id)
 
+# One-off TensorRT (CUDA) / OpenVINO export that get_model() then prefers
+def export_model():
     model = YOLO(MODEL_PATH)
-    print(f"[Detect] Running detection for lot {lot_id}")
+    size = PREDICT_KW["imgsz"]
+    if CUDA_OK:
+        # Dynamic batch so `--lots` can run several lots per predict
+        out = model.export(format="engine", half=True, imgsz=size, device=0,
+                           dynamic=True, batch=EXPORT_BATCH)
+    else:
+        out = model.export(format="openvino", imgsz=size)
+    print(f"[Detect] Exported {out}")
 
-    last_mtime = None
-    latest_path = os.path.join(frames_dir, "latest.jpg")
 
-    while True:
-        if not os.path.exists(latest_path):
-            time.sleep(1)
-            continue
+# Grayscale THUMB_SIZE thumbnail for the static-frame check
+def frame_thumb(img):
+    small = cv2.resize(img, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
 
-        try:
-            mtime = os.path.getmtime(latest_path)
-        except FileNotFoundError:
-            time.sleep(1)
-            continue
 
+# Largest mean abs difference over any THUMB_CELLS cell; a global mean
+# would dilute one car arriving or leaving below the threshold
+def thumb_diff(a, b):
+    diff = cv2.resize(cv2.absdiff(a, b), THUMB_CELLS, interpolation=cv2.INTER_AREA)
+    return diff.max()
+
+
+def config_mtime(lot_id):
+    try:
+        return os.path.getmtime(get_paths(lot_id)[0])
+    except OSError:
+        return None
+
+
+# New frames for one lot: shared memory, else latest.jpg by mtime
+class LotFeed:
+    def __init__(self, lot_id):
+        ensure_dirs(lot_id)
+        self.lot_id = lot_id
+        self.latest_path = os.path.join(get_paths(lot_id)[1], "latest.jpg")
+        self.shared = SharedFrameReader(lot_id)
+        self.changed = None  # watchdog event, started by the first wait()
+        self.watching = False
+        self.last_mtime = None
+        self.from_shm = False
+        # (thumb, config mtime, loop time, history settled, overlay, occ)
+        # of the last frame that made it through finish_frame
+        self.last = None
+
+    # Newest frame not returned before, or None; never blocks
+    def poll(self):
+        img = self.shared.read()
+        if img is not None:
+            self.from_shm = True
+        if img is not None or self.shared.attached:
+            return img
+
+        try:
+            mtime = os.path.getmtime(self.latest_path)
+        except OSError:
+            return None
+        if self.from_shm:
+            # Just lost shared memory: capture wrote this latest.jpg alongside
+            # the frames already seen there, so only a later write is new
+            self.from_shm = False
+            self.last_mtime = mtime
+            return None
         # Only run when latest.jpg was updated
-        if last_mtime is not None and mtime <= last_mtime:
-            time.sleep(0.5)
+        if self.last_mtime is not None and mtime <= self.last_mtime:
+            return None
+        self.last_mtime = mtime
+
+        img = cv2.imread(self.latest_path)
+        if img is None:
+            print(f"[Detect] Skipping unreadable frame: {self.latest_path}")
+        return img
+
+    # Sleep until a new frame is likely, at most timeout seconds
+    def wait(self, timeout=1.0):
+        if self.shared.attached:
+            time.sleep(min(0.05, timeout))
+            return
+        if not self.watching:
+            self.changed, self.watching = watch_file(self.latest_path), True
+        if self.changed is not None and self.last_mtime is not None:
+            self.changed.wait(timeout)
+            self.changed.clear()
+        else:
+            time.sleep(min(0.5, timeout))
+
+    # Record a successfully analysed frame for unchanged()
+    def analysed(self, thumb, started, cfg, overlay_path, occ):
+        self.last = (thumb, cfg["mtime"], started, history_settled(cfg),
+                     overlay_path, occ)
+
+    # True when thumb matches the last analysed frame and its votes are
+    # settled, so YOLO can be skipped
+    def unchanged(self, thumb, now):
+        if self.last is None:
+            return False
+        last_thumb, cfg_t, run, settled, _, _ = self.last
+        return (settled and now - run < RESCAN_SECS and
+                cfg_t == config_mtime(self.lot_id) and
+                thumb_diff(thumb, last_thumb) < STATIC_DIFF)
+
+    # Re-save the last result for a skipped frame, so the dashboard's
+    # last-updated time keeps moving on a static scene
+    def refresh(self):
+        try:
+            _, _, _, _, overlay_path, occ = self.last
+            save_occupancy(self.lot_id, self.latest_path, overlay_path, occ)
+        except Exception as e:
+            print(f"[Detect] ERROR {self.lot_id}: {e}")
+
+
+def run_lot(lot_id, model):
+    feed = LotFeed(lot_id)
+    post = ThreadPoolExecutor(max_workers=1)
+    pending = None
+
+    while True:
+        img = feed.poll()
+        if img is None:
+            feed.wait()
             continue
 
-        last_mtime = mtime
+        started = time.monotonic()
 
         try:
-            result = detect_frame(latest_path, model, lot_id)
-            if result is None:
-                continue
-
-            overlay_path, occ, map_path = result
-            save_detection_result(
-                frame_path=latest_path,
-                overlay_path=overlay_path,
-                occupied_count=sum(occ.values()),
-                free_count=len(occ) - sum(occ.values()),
-                stall_status=occ,
-                lot_id=lot_id,
-            )
-            print(f"[Detect] Lot {lot_id}: processed frame {latest_path}")
+            thumb = frame_thumb(img)
+            if feed.unchanged(thumb, started):
+                # Queued behind any pending finish_frame so rows stay in order
+                post.submit(feed.refresh)
+            else:
+                res = detect_frames([img], model)[0]
+
+                # Post-process this frame while the loop moves on to the
+                # next one; waiting on the previous job keeps at most one
+                # in flight
+                if pending is not None:
+                    pending.result()
+                pending = post.submit(finish_frame, img, res, feed, thumb, started)
         except Exception as e:
             print(f"[Detect] ERROR {lot_id}: {e}")
 
-        time.sleep(CHECK_INTERVAL)
+        # Rate-limit to one run per CHECK_INTERVAL measured from the start
+        # of this run, so inference time is not added on top of the wait
+        time.sleep(max(0.0, started + CHECK_INTERVAL - time.monotonic()))
+
+
+# Several lots in one process: one batched predict per CHECK_INTERVAL
+def run_lots(lot_ids, model):
+    feeds = [LotFeed(lid) for lid in lot_ids]
+    post = ThreadPoolExecutor(max_workers=1)
+    pending = []
+
+    while True:
+        started = time.monotonic()
+
+        batch = []
+        for feed in feeds:
+            try:
+                img = feed.poll()
+                if img is None:
+                    continue
+                thumb = frame_thumb(img)
+                if feed.unchanged(thumb, started):
+                    post.submit(feed.refresh)
+                else:
+                    batch.append((feed, img, thumb))
+            except Exception as e:
+                print(f"[Detect] ERROR {feed.lot_id}: {e}")
+
+        if batch:
+            try:
+                preds = detect_frames([img for _, img, _ in batch], model)
+                for f in pending:
+                    f.result()
+                pending = [
+                    post.submit(finish_frame, img, res, feed, thumb, started)
+                    for (feed, img, thumb), res in zip(batch, preds)
+                ]
+            except Exception as e:
+                print(f"[Detect] ERROR lots {lot_ids}: {e}")
+
+        time.sleep(max(0.0, started + CHECK_INTERVAL - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--lot", type=int)
+    group.add_argument("--lots", type=str,
+                       help="comma-separated lot ids, batched through one model")
+    group.add_argument("--export", action="store_true",
+                       help="build the TensorRT/OpenVINO model and exit")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ,
+                        help="inference size (long side, multiple of 32); "
+                             "export with the same value")
+    args = parser.parse_args()
+    PREDICT_KW["imgsz"] = args.imgsz
+    if args.export:
+        export_model()
+        return
+
+    model = get_model()
+    device = 'cuda:0 (fp16)' if CUDA_OK else 'cpu'
+
+    if args.lot is not None:
+        print(f"[Detect] Running detection for lot {args.lot} on {device}")
+        run_lot(args.lot, model)
+        return
+
+    lot_ids = [int(x) for x in args.lots.split(",") if x.strip()]
+    print(f"[Detect] Running detection for lots {lot_ids} on {device}")
+    run_lots(lot_ids, model)
 
 
 if __name__ == "__main__":
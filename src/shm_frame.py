@@ -0,0 +1,127 @@
+import os, struct, sys, time, numpy as np
+from multiprocessing import shared_memory
+
+# Latest raw BGR frame per lot, handed from capture.py to detect.py
+# through shared memory instead of a JPEG round trip via latest.jpg.
+#
+# Layout: HDR_SIZE header bytes, then h*w*3 pixel bytes.
+# Header: seq (u64), h, w, closed (u32), gen (u64). seq is a seqlock
+# counter: odd while the writer is copying, even once the frame is
+# complete. gen identifies the producer, so a reader that re-attaches to
+# the same producer does not take its last frame for a new one.
+_HDR = struct.Struct("<QIIIQ")
+HDR_SIZE = 64
+MAX_FRAME_BYTES = 3840 * 2160 * 3  # up to 4K; pages are only touched as used
+STALE_SECS = 10.0  # reader re-attaches after this long without a new frame
+
+
+def shm_name(lot_id):
+    return f"spotection_lot{lot_id}_frame"
+
+
+# Open an existing segment without handing it to our resource tracker
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        # Otherwise this process's tracker unlinks the producer's segment
+        # when we exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+# Producer side, owned by the capture loop of one lot
+class SharedFrameWriter:
+    def __init__(self, lot_id, capacity=MAX_FRAME_BYTES):
+        name = shm_name(lot_id)
+        size = HDR_SIZE + capacity
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a capture process that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.capacity = capacity
+        self.seq = 0
+        self.gen = time.time_ns()
+
+    # Publish a BGR uint8 frame; False if it does not fit
+    def write(self, frame):
+        if frame.ndim != 3 or frame.shape[2] != 3 or frame.nbytes > self.capacity:
+            return False
+        h, w = frame.shape[:2]
+        buf = self.shm.buf
+        self.seq += 1
+        _HDR.pack_into(buf, 0, self.seq, h, w, 0, self.gen)
+        np.ndarray((h, w, 3), np.uint8, buf, HDR_SIZE)[...] = frame
+        self.seq += 1
+        _HDR.pack_into(buf, 0, self.seq, h, w, 0, self.gen)
+        return True
+
+    def close(self):
+        _HDR.pack_into(self.shm.buf, 0, self.seq, 0, 0, 1, self.gen)
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Consumer side: read() returns each new frame once (fresh array) or None
+class SharedFrameReader:
+    def __init__(self, lot_id):
+        self.name = shm_name(lot_id)
+        self.shm = None
+        self.gen = None
+        self.last_seq = 0
+        self.last_new = 0.0
+        self.retry_at = 0.0
+
+    @property
+    def attached(self):
+        return self.shm is not None
+
+    def _detach(self):
+        if self.shm is not None:
+            self.shm.close()
+        self.shm = None
+
+    def read(self):
+        now = time.monotonic()
+        if self.shm is None:
+            if now < self.retry_at:
+                return None
+            try:
+                self.shm = _attach(self.name)
+            except FileNotFoundError:
+                return None
+
+        buf = self.shm.buf
+        for _ in range(3):
+            seq, h, w, closed, gen = _HDR.unpack_from(buf, 0)
+            if closed:
+                self._detach()
+                return None
+            if gen != self.gen:
+                self.gen, self.last_seq, self.last_new = gen, 0, now
+            if seq == self.last_seq:
+                # A crashed producer leaves a segment that never advances;
+                # check back for a restarted one every STALE_SECS
+                if now - self.last_new > STALE_SECS:
+                    self._detach()
+                    self.retry_at = now + STALE_SECS
+                return None
+            if seq & 1:
+                time.sleep(0.001)  # writer mid-copy
+                continue
+
+            out = np.array(np.ndarray((h, w, 3), np.uint8, buf, HDR_SIZE))
+
+            if _HDR.unpack_from(buf, 0)[0] == seq:
+                self.last_seq, self.last_new = seq, now
+                return out
+        return None
+
+    def close(self):
+        self._detach()
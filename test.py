@@ -1,27 +1,53 @@
 # test_env.py
 # Quick check that all dependencies are installed and working
 
-import flask
-import cv2
-import numpy as np
-import torch
-import ultralytics
+from importlib.metadata import version, PackageNotFoundError
+
+
+def dist_version(*names):
+    """Installed version of the first distribution found, without importing it."""
+    for name in names:
+        try:
+            return version(name)
+        except PackageNotFoundError:
+            pass
+    return None
+
 
 def main():
     print("✅ Environment check starting...\n")
 
-    print(f"Flask version: {flask.__version__}")
-    print(f"OpenCV version: {cv2.__version__}")
-    print(f"Numpy version: {np.__version__}")
-    print(f"Torch version: {torch.__version__}")
-    print(f"Ultralytics (YOLO) version: {ultralytics.__version__}")
+    # Read from package metadata: importing torch/ultralytics just for a
+    # version string would load the CUDA runtime
+    missing = []
+    for label, dists in (
+        ("Flask", ("flask",)),
+        ("OpenCV", ("opencv-python", "opencv-python-headless",
+                    "opencv-contrib-python", "opencv-contrib-python-headless")),
+        ("Numpy", ("numpy",)),
+        ("Torch", ("torch",)),
+        ("Ultralytics (YOLO)", ("ultralytics",)),
+    ):
+        v = dist_version(*dists)
+        print(f"{label} version: {v or 'NOT INSTALLED'}")
+        if v is None:
+            missing.append(label)
 
-    # Check CUDA (GPU support) for PyTorch
-    print("\nPyTorch CUDA available:", torch.cuda.is_available())
-    if torch.cuda.is_available():
-        print("CUDA device:", torch.cuda.get_device_name(0))
+    # Check CUDA (GPU support) for PyTorch; the only check that needs the import
+    try:
+        import torch
+        print("\nPyTorch CUDA available:", torch.cuda.is_available())
+        if torch.cuda.is_available():
+            print("CUDA device:", torch.cuda.get_device_name(0))
+    except Exception as e:
+        print("\nPyTorch import failed:", e)
+        if "Torch" not in missing:
+            missing.append("Torch (import)")
 
-    print("\n All imports succeeded!")
+    if missing:
+        print("\n Missing or broken:", ", ".join(missing))
+    else:
+        print("\n All packages found!")
 
 if __name__ == "__main__":
     main()